@@ -16,85 +16,113 @@
 
 from docx import Document
 import re
-import pandas as pd
 from collections import Counter
+from functools import lru_cache
 from rag.nlp import rag_tokenizer
 from io import BytesIO
 
+_BLOCK_TYPE_PATTERNS = [
+    ("^(20|19)[0-9]{2}[年/-][0-9]{1,2}[月/-][0-9]{1,2}日*$", "Dt"),
+    (r"^(20|19)[0-9]{2}年$", "Dt"),
+    (r"^(20|19)[0-9]{2}[年/-][0-9]{1,2}月*$", "Dt"),
+    ("^[0-9]{1,2}[月/-][0-9]{1,2}日*$", "Dt"),
+    (r"^第*[一二三四1-4]季度$", "Dt"),
+    (r"^(20|19)[0-9]{2}年*[一二三四1-4]季度$", "Dt"),
+    (r"^(20|19)[0-9]{2}[ABCDE]$", "DT"),
+    ("^[0-9.,+%/ -]+$", "Nu"),
+    (r"^[0-9A-Z/\._~-]+$", "Ca"),
+    (r"^[A-Z]*[a-z' -]+$", "En"),
+    (r"^[0-9.,+-]+[0-9A-Za-z/$￥%<>（）()' -]+$", "NE"),
+    (r"^.{1}$", "Sg")
+]
+# One alternation tried in order: the first alternative that matches wins,
+# same as testing the patterns one by one. The group name indexes _BLOCK_TYPES.
+_BLOCK_TYPE_REGEX = re.compile("|".join(f"(?P<p{i}>{p})" for i, (p, _) in enumerate(_BLOCK_TYPE_PATTERNS)))
+_BLOCK_TYPES = [n for _, n in _BLOCK_TYPE_PATTERNS]
+
+
+# Table cells repeat a lot across a document ("Total", "N/A", units), so
+# tokenizer results are shared by every table parsed in this process.
+@lru_cache(maxsize=8192)
+def _tokenize(b):
+    return [t for t in rag_tokenizer.tokenize(b).split() if len(t) > 1]
+
+
+@lru_cache(maxsize=8192)
+def _tag(tk):
+    return rag_tokenizer.tag(tk)
+
 
 class RAGFlowDocxParser:
 
     def __extract_table_content(self, tb):
-        df = []
+        if len(tb.rows) < 2:
+            return []
+        rows = []
         for row in tb.rows:
-            df.append([c.text for c in row.cells])
-        return self.__compose_table_content(pd.DataFrame(df))
+            rows.append([c.text for c in row.cells])
+        # pad ragged rows so every row spans the full table width
+        ncols = max((len(r) for r in rows), default=0)
+        for r in rows:
+            r.extend([""] * (ncols - len(r)))
+        return self.__compose_table_content(rows)
 
-    def __compose_table_content(self, df):
+    def __compose_table_content(self, rows):
+        block_types = {}  # cell text -> block type, for this table only
 
         def blockType(b):
-            pattern = [
-                ("^(20|19)[0-9]{2}[年/-][0-9]{1,2}[月/-][0-9]{1,2}日*$", "Dt"),
-                (r"^(20|19)[0-9]{2}年$", "Dt"),
-                (r"^(20|19)[0-9]{2}[年/-][0-9]{1,2}月*$", "Dt"),
-                ("^[0-9]{1,2}[月/-][0-9]{1,2}日*$", "Dt"),
-                (r"^第*[一二三四1-4]季度$", "Dt"),
-                (r"^(20|19)[0-9]{2}年*[一二三四1-4]季度$", "Dt"),
-                (r"^(20|19)[0-9]{2}[ABCDE]$", "DT"),
-                ("^[0-9.,+%/ -]+$", "Nu"),
-                (r"^[0-9A-Z/\._~-]+$", "Ca"),
-                (r"^[A-Z]*[a-z' -]+$", "En"),
-                (r"^[0-9.,+-]+[0-9A-Za-z/$￥%<>（）()' -]+$", "NE"),
-                (r"^.{1}$", "Sg")
-            ]
-            for p, n in pattern:
-                if re.search(p, b):
-                    return n
-            tks = [t for t in rag_tokenizer.tokenize(b).split() if len(t) > 1]
+            if b not in block_types:
+                block_types[b] = classify(b)
+            return block_types[b]
+
+        def classify(b):
+            m = _BLOCK_TYPE_REGEX.match(b)
+            if m:
+                return _BLOCK_TYPES[int(m.lastgroup[1:])]
+            tks = _tokenize(b)
             if len(tks) > 3:
                 if len(tks) < 12:
                     return "Tx"
                 else:
                     return "Lx"
 
-            if len(tks) == 1 and rag_tokenizer.tag(tks[0]) == "nr":
+            if len(tks) == 1 and _tag(tks[0]) == "nr":
                 return "Nr"
 
             return "Ot"
 
-        if len(df) < 2:
+        if len(rows) < 2:
             return []
-        max_type = Counter([blockType(str(df.iloc[i, j])) for i in range(
-            1, len(df)) for j in range(len(df.iloc[i, :]))])
-        max_type = max(max_type.items(), key=lambda x: x[1])[0]
+        ncols = len(rows[0])
+        # classify every data cell once; the table-wide and per-row dominant
+        # types are both derived from the per-row counters
+        row_types = [Counter([blockType(c) for c in row]) for row in rows[1:]]
+        max_type = Counter()
+        for tys in row_types:
+            max_type.update(tys)
+        max_type = max_type.most_common(1)[0][0]
 
-        colnm = len(df.iloc[0, :])
         hdrows = [0]  # header is not necessarily appear in the first line
         if max_type == "Nu":
-            for r in range(1, len(df)):
-                tys = Counter([blockType(str(df.iloc[r, j]))
-                              for j in range(len(df.iloc[r, :]))])
-                tys = max(tys.items(), key=lambda x: x[1])[0]
-                if tys != max_type:
+            for r, tys in enumerate(row_types, start=1):
+                if tys.most_common(1)[0][0] != max_type:
                     hdrows.append(r)
 
         lines = []
-        for i in range(1, len(df)):
-            if i in hdrows:
+        is_header = set(hdrows)
+        hr = [0]  # last contiguous run of header rows above the current row
+        for i in range(1, len(rows)):
+            if i in is_header:
+                if hr[-1] == i - 1:
+                    hr.append(i)
+                else:
+                    hr = [i]
                 continue
-            hr = [r - i for r in hdrows]
-            hr = [r for r in hr if r < 0]
-            t = len(hr) - 1
-            while t > 0:
-                if hr[t] - hr[t - 1] > 1:
-                    hr = hr[t:]
-                    break
-                t -= 1
             headers = []
-            for j in range(len(df.iloc[i, :])):
+            for j in range(ncols):
                 t = []
                 for h in hr:
-                    x = str(df.iloc[i + h, j]).strip()
+                    x = rows[h][j].strip()
                     if x in t:
                         continue
                     t.append(x)
@@ -103,13 +131,13 @@ class RAGFlowDocxParser:
                     t += ": "
                 headers.append(t)
             cells = []
-            for j in range(len(df.iloc[i, :])):
-                if not str(df.iloc[i, j]):
+            for j in range(ncols):
+                if not rows[i][j]:
                     continue
-                cells.append(headers[j] + str(df.iloc[i, j]))
+                cells.append(headers[j] + rows[i][j])
             lines.append(";".join(cells))
 
-        if colnm > 3:
+        if ncols > 3:
             return lines
         return ["\n".join(lines)]
 
@@ -122,11 +150,12 @@ class RAGFlowDocxParser:
             if pn > to_page:
                 break
 
+            has_text = bool(p.text.strip()) # p.text joins every run, so compute it once per paragraph
             runs_within_single_paragraph = [] # save runs within the range of pages
             for run in p.runs:
                 if pn > to_page:
                     break
-                if from_page <= pn < to_page and p.text.strip():
+                if from_page <= pn < to_page and has_text:
                     runs_within_single_paragraph.append(run.text) # append run.text first
 
                 # wrap page break checker into a static method